@@ -0,0 +1,66 @@
+from frame import as_frame
+# Pillow, numpy and matplotlib are imported in the functions using them
+
+def pixel_boxes(faces, size):
+    ''' Returns bounding boxes of all FaceResults in one numpy array
+    of left, top, right and bottom in pixels, one row per face. '''
+    import numpy as np
+    width, height = size
+    boxes = np.array([face.box for face in faces], dtype=float).reshape(-1, 4)
+    boxes[:, 2:] += boxes[:, :2]
+    scale = np.array([width, height, width, height], dtype=float)
+    return np.clip(boxes * scale, 0, scale)
+
+def render_matplotlib(kuvatiedosto, kuvatiedosto2, boxes, listofdetails, dpi=300):
+    ''' Draws boxes around faces and writes details next to the picture. The figure
+    is composed first and saved to kuvatiedosto2 once. Boxes are from pixel_boxes. '''
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as patches
+    from matplotlib.collections import PatchCollection
+
+    # Picture is decoded only once and shared as Frame
+    frame = as_frame(kuvatiedosto)
+    width,height = frame.size
+    # Create figure and axes
+    fig,ax = plt.subplots(1)
+    # Display the image
+    ax.imshow(frame.array)
+
+    # Create Rectangle patches for all faces and add them to the Axes as one collection
+    rects = [patches.Rectangle((left,top),right-left,bottom-top) for left,top,right,bottom in boxes]
+    ax.add_collection(PatchCollection(rects,linewidth=1,edgecolor='b',facecolor='none'))
+    for n in range(0,len(boxes)):
+        ax.text(boxes[n][0],boxes[n][1]-5,str(n+1),color='b',fontsize=7)
+
+    # Insert text from Rekognition
+    for j in range(0,len(listofdetails)):
+        plt.text((width+50),height/4+j*75,listofdetails[j],fontsize=7)
+    # Render and encode the picture once, after all text is added
+    fig.savefig(kuvatiedosto2, orientation='portrait', dpi = dpi)
+    return fig
+
+def render_pil(kuvatiedosto, kuvatiedosto2, boxes, listofdetails, quality=90):
+    ''' Draws boxes around faces and writes details next to the picture with Pillow only.
+    Boxes are from pixel_boxes.
+    Picture is a Frame, bytes or file, it is decoded only if not decoded already.
+    Text goes to a white area added to the right side of the picture. Saves the
+    result to kuvatiedosto2 and returns it as Pillow image. '''
+    from PIL import Image, ImageDraw, ImageFont
+    font = ImageFont.load_default()
+    lineheight = 12
+
+    img = as_frame(kuvatiedosto).image
+    width, height = img.size
+    measure = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+    textwidth = max([measure.textlength(line, font=font) for line in listofdetails] or [0])
+    canvas = Image.new('RGB', (width + int(textwidth) + 20, max(height, len(listofdetails) * lineheight + 20)), 'white')
+    canvas.paste(img, (0, 0))
+
+    draw = ImageDraw.Draw(canvas)
+    for n, box in enumerate(boxes.tolist()):
+        draw.rectangle(box, outline='blue', width=2)
+        draw.text((box[0] + 3, box[1] + 3), str(n + 1), fill='blue', font=font)
+    for j in range(0, len(listofdetails)):
+        draw.text((width + 10, 10 + j*lineheight), listofdetails[j], fill='black', font=font)
+    canvas.save(kuvatiedosto2, 'JPEG', quality=quality)
+    return canvas
@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+from collections import deque
+import vlc
+
+# Safety net for playback that never reports ending
+MAX_PLAYBACK_SECONDS = 120
+PLAYBACK_MARGIN = 5
+
+class Playback(object):
+    ''' Handle to audio being played by AudioPlayer. Finishes when VLC reports
+    end of media, an error or stop. '''
+
+    def __init__(self, audioplayer):
+        self.audioplayer = audioplayer
+        self.requested = time.time()
+        # Seconds from play() until VLC started playing
+        self.startup_latency = None
+        self._done = threading.Event()
+        # Read end of the pipe VLC plays from, when playing bytes or chunks
+        self._readfd = None
+        self._pipe_lock = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        ''' Waits until playback has ended. Returns True if it ended in time.
+        Without timeout, waits for length of the clip plus PLAYBACK_MARGIN seconds,
+        or MAX_PLAYBACK_SECONDS if length is not known, and then stops the player. '''
+        if timeout is not None:
+            return self._done.wait(timeout)
+        deadline = self.requested + MAX_PLAYBACK_SECONDS
+        while not self._done.wait(0.25):
+            length = self.audioplayer.player.get_length()
+            if length > 0:
+                deadline = min(deadline, self.requested + length / 1000.0 + PLAYBACK_MARGIN)
+            if time.time() > deadline:
+                self.cancel()
+                return False
+        return True
+
+    def cancel(self):
+        ''' Stops playback if it is still playing. '''
+        self.audioplayer._stop(self)
+        self._done.set()
+
+    def _close_pipe(self):
+        # VLC does not close file descriptors it was given. Closing the read end
+        # lets the feeder see a broken pipe instead of blocking on a full pipe.
+        with self._pipe_lock:
+            if self._readfd is not None:
+                os.close(self._readfd)
+                self._readfd = None
+
+class AudioPlayer(object):
+    ''' Long-lived VLC instance and media player. Created once and reused for every
+    response, so VLC initialisation is not paid on each playback.
+    Plays files, bytes or an iterable of byte chunks still being downloaded. '''
+
+    def __init__(self, caching_ms=200):
+        self.caching_ms = caching_ms
+        self.instance = vlc.Instance()
+        self.player = self.instance.media_player_new()
+        # Startup latencies of recent playbacks in seconds
+        self.startup_latencies = deque(maxlen=100)
+        self._lock = threading.Lock()
+        self._current = None
+        events = self.player.event_manager()
+        events.event_attach(vlc.EventType.MediaPlayerPlaying, self._on_playing)
+        events.event_attach(vlc.EventType.MediaPlayerEndReached, self._on_finished)
+        events.event_attach(vlc.EventType.MediaPlayerEncounteredError, self._on_finished)
+        events.event_attach(vlc.EventType.MediaPlayerStopped, self._on_stopped)
+
+    # VLC callbacks run in VLC's own thread and must not call the player or take the lock
+    def _on_playing(self, event):
+        playback = self._current
+        if playback is not None and playback.startup_latency is None:
+            playback.startup_latency = time.time() - playback.requested
+            self.startup_latencies.append(playback.startup_latency)
+
+    def _on_finished(self, event):
+        playback = self._current
+        if playback is not None:
+            playback._done.set()
+            playback._close_pipe()
+
+    def _on_stopped(self, event):
+        # Stop of the previous media can be delivered after new media was set,
+        # cancel() marks a playback done that was stopped before it started
+        playback = self._current
+        if playback is not None and playback.startup_latency is not None:
+            playback._done.set()
+
+    def play(self, source, block=True, timeout=None):
+        ''' Plays source, which is a path to audio file, bytes or an iterable of byte chunks.
+        Anything already playing is stopped. Returns a Playback handle; with block=True
+        returns after playback has ended or timeout seconds have passed. '''
+        with self._lock:
+            if self._current is not None:
+                self.player.stop()
+                self._current._done.set()
+                self._current._close_pipe()
+            playback = Playback(self)
+            self._current = playback
+            self.player.set_media(self._media(source, playback))
+            self.player.play()
+        if block:
+            if not playback.wait(timeout) and timeout is not None:
+                playback.cancel()
+        return playback
+
+    def _media(self, source, playback):
+        if isinstance(source, str):
+            return self.instance.media_new(source)
+        if isinstance(source, (bytes, bytearray)):
+            source = [bytes(source)]
+        readfd, writefd = os.pipe()
+        playback._readfd = readfd
+        feeder = threading.Thread(target=_feed, args=(writefd, source))
+        feeder.daemon = True
+        feeder.start()
+        media = self.instance.media_new_fd(readfd)
+        media.add_option(':file-caching=%d' % self.caching_ms)
+        return media
+
+    def _stop(self, playback):
+        with self._lock:
+            if self._current is playback:
+                self.player.stop()
+        playback._close_pipe()
+
+    def close(self):
+        ''' Stops playback and releases VLC resources. '''
+        with self._lock:
+            self.player.stop()
+            if self._current is not None:
+                self._current._close_pipe()
+            self.player.release()
+            self.instance.release()
+
+def _feed(writefd, chunks):
+    ''' Writes chunks to the pipe VLC reads from. When playback ends or is stopped
+    its read end is closed, and the rest of the chunks are still consumed without
+    writing, so a download being cached completes. '''
+    pipe = os.fdopen(writefd, 'wb', 0)
+    try:
+        for chunk in chunks:
+            if not pipe.closed:
+                try:
+                    pipe.write(chunk)
+                except (BrokenPipeError, ValueError):
+                    pipe.close()
+    finally:
+        if not pipe.closed:
+            pipe.close()
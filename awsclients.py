@@ -0,0 +1,46 @@
+import threading
+
+# Settings shared by all AWS clients
+REGION = None
+MAX_POOL_CONNECTIONS = 10
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+RETRY_MODE = 'adaptive'
+MAX_ATTEMPTS = 4
+
+_session = None
+_clients = {}
+_lock = threading.Lock()
+
+def get_session():
+    ''' Returns boto3 session shared by all clients, so credentials are
+    looked up only once. '''
+    global _session
+    with _lock:
+        if _session is None:
+            import boto3
+            _session = boto3.session.Session(region_name=REGION)
+            # Resolve credentials now instead of on first call of each client
+            _session.get_credentials()
+        return _session
+
+def client_config():
+    ''' Returns botocore config with connection pool, keep-alive, timeouts and retries. '''
+    from botocore.config import Config
+    return Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        retries={'mode': RETRY_MODE, 'max_attempts': MAX_ATTEMPTS}
+        )
+
+def client(service, region=None):
+    ''' Returns client for AWS service. Clients are created once per service
+    and region and reused, so open connections are reused too. '''
+    session = get_session()
+    with _lock:
+        key = (service, region)
+        if key not in _clients:
+            _clients[key] = session.client(service, region_name=region, config=client_config())
+        return _clients[key]
@@ -0,0 +1,151 @@
+''' Runs Rekognition over every picture in a local directory or S3 prefix.
+
+    $ python3 batch.py archive/ --reference master_to_be_recognised.jpg --labels
+    $ python3 batch.py s3://bucket/pictures/ --workers 8 --tps 5
+
+Results are appended to a JSON Lines log, which also records progress: pictures
+already in the log are skipped, so an interrupted run continues where it stopped.
+'''
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import rekognition
+from detectionlog import DetectionLog
+from frame import Frame
+
+PICTURE_TYPES = ('.jpg', '.jpeg', '.png')
+
+class TokenBucket(object):
+    ''' Rate limiter allowing rate calls per second on average, with bursts of
+    up to capacity calls. '''
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        # At least one token, or rates below one call per second would never allow a call
+        self.capacity = max(1.0, float(capacity or rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        ''' Waits until tokens are available and takes them. '''
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                delay = (tokens - self.tokens) / self.rate
+            time.sleep(delay)
+
+def list_pictures(source):
+    ''' Yields (picture id, bucket, picture) for pictures in a local directory or
+    under s3://bucket/prefix. Picture is a Frame for local files and an object name for S3. '''
+    if source.startswith('s3://'):
+        import awsclients
+        bucket, _, prefix = source[5:].partition('/')
+        paginator = awsclients.client('s3').get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                if item['Key'].lower().endswith(PICTURE_TYPES):
+                    yield 's3://%s/%s' % (bucket, item['Key']), bucket, item['Key']
+    else:
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(PICTURE_TYPES):
+                    path = os.path.join(root, name)
+                    yield path, None, path
+
+def analyse_picture(bucket, picture, faces, labels, reference, collection_id):
+    ''' Runs the chosen analyses for one picture, returns FrameAnalysis. A failed
+    analysis is recorded in errors, so results of the other calls are kept. '''
+    if not isinstance(picture, Frame) and bucket is None:
+        picture = Frame.from_file(picture)
+    start = time.time()
+    analysis = rekognition.FrameAnalysis()
+    calls = []
+    if faces:
+        calls.append(('faces', rekognition.detect_faces, (bucket, picture)))
+    if labels:
+        calls.append(('labels', rekognition.detect_labels, (bucket, picture)))
+    if collection_id is not None:
+        calls.append(('match', rekognition.identify_person, (collection_id, bucket, picture)))
+    elif reference is not None:
+        calls.append(('match', rekognition.compare_faces, (bucket, picture, reference)))
+    for name, function, args in calls:
+        try:
+            setattr(analysis, name, function(*args))
+        except Exception as error:
+            analysis.errors[name] = error
+    analysis.elapsed = time.time() - start
+    return analysis
+
+def run_batch(source, output='batch_results.jsonl', faces=True, labels=False, reference=None,
+              collection_id=None, workers=4, tps=5):
+    ''' Analyses all pictures in source with a pool of workers, calling Rekognition
+    at most tps times per second. Pictures already in output are skipped.
+    Returns a dict with counts and throughput. '''
+    log = DetectionLog(output, max_bytes=1024 ** 3)
+    done = set(record['picture'] for record in log)
+    rekognition.rate_limiter = TokenBucket(tps)
+    if reference is not None:
+        reference = Frame.from_file(reference)
+    report = {'analysed': 0, 'skipped': 0, 'failed': 0}
+    jobs = {}
+
+    def record(job):
+        pictureid = jobs.pop(job)
+        try:
+            log.append(job.result().to_record(pictureid))
+            report['analysed'] += 1
+        except Exception as error:
+            print('%s: %s' % (pictureid, error))
+            report['failed'] += 1
+
+    start = time.time()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for pictureid, bucket, picture in list_pictures(source):
+            if pictureid in done:
+                report['skipped'] += 1
+                continue
+            jobs[executor.submit(analyse_picture, bucket, picture, faces, labels,
+                                 reference, collection_id)] = pictureid
+        for job in as_completed(list(jobs)):
+            record(job)
+    except BaseException:
+        # Interrupted: pictures not yet started are not sent to Rekognition.
+        # Results of calls already made are logged, so a resumed run skips them.
+        executor.shutdown(wait=True, cancel_futures=True)
+        for job in list(jobs):
+            if job.done() and not job.cancelled():
+                record(job)
+        raise
+    finally:
+        executor.shutdown()
+        rekognition.rate_limiter = None
+        log.close()
+    report['seconds'] = time.time() - start
+    report['pictures_per_second'] = report['analysed'] / report['seconds'] if report['seconds'] else 0
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('source', help='local directory or s3://bucket/prefix')
+    parser.add_argument('--output', default='batch_results.jsonl')
+    parser.add_argument('--no-faces', dest='faces', action='store_false')
+    parser.add_argument('--labels', action='store_true')
+    parser.add_argument('--reference', help='local picture to compare faces with')
+    parser.add_argument('--collection', help='face collection to search faces from')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--tps', type=float, default=5, help='Rekognition calls per second')
+    args = parser.parse_args()
+    report = run_batch(args.source, args.output, args.faces, args.labels, args.reference,
+                       args.collection, args.workers, args.tps)
+    print('Analysed %(analysed)d, skipped %(skipped)d, failed %(failed)d pictures '
+          'in %(seconds).1f s (%(pictures_per_second).2f pictures/s)' % report)
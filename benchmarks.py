@@ -0,0 +1,115 @@
+''' Simple timing benchmarks for Brutus components.
+
+    $ python3 benchmarks.py capture --fake picture.jpg
+    $ python3 benchmarks.py render picture.jpg
+    $ python3 benchmarks.py stream --seconds 3
+'''
+import argparse
+import time
+
+def timeit(function, rounds):
+    ''' Runs function rounds times, returns list of durations in seconds. '''
+    durations = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def report(name, durations):
+    durations = sorted(durations)
+    print('%-30s min %8.1f ms  median %8.1f ms  max %8.1f ms' % (
+        name, durations[0] * 1000, durations[len(durations) // 2] * 1000, durations[-1] * 1000))
+
+def benchmark_capture(args):
+    from raspberrypi_picture import CameraSession, FakeCamera
+    start = time.perf_counter()
+    camera = FakeCamera(args.fake) if args.fake else CameraSession()
+    with camera:
+        report('open', [time.perf_counter() - start])
+        report('capture to file', timeit(lambda: camera.capture('benchmark_capture.jpg'), args.rounds))
+        report('capture to bytes', timeit(camera.capture_bytes, args.rounds))
+        report('capture to array', timeit(camera.capture_array, args.rounds))
+
+def fake_face(i):
+    ''' Returns face details in the form Rekognition returns them. '''
+    value = {'Value': False, 'Confidence': 99.0}
+    return {
+        'BoundingBox': {'Width': 0.1, 'Height': 0.15, 'Left': 0.05 + 0.1 * (i % 8), 'Top': 0.1 + 0.2 * (i // 8 % 4)},
+        'AgeRange': {'Low': 26, 'High': 43},
+        'Beard': value, 'Mustache': value, 'Smile': value, 'Eyeglasses': value,
+        'Sunglasses': value, 'EyesOpen': {'Value': True, 'Confidence': 98.0},
+        'Gender': {'Value': 'Male', 'Confidence': 97.0},
+        'Emotions': [{'Type': t, 'Confidence': 10.0} for t in ('CALM', 'HAPPY', 'SAD')],
+    }
+
+def benchmark_render(args):
+    from annotate import pixel_boxes, render_pil
+    from frame import Frame
+    from rekognition import describe_face
+    from results import FaceResult
+    picture = Frame.from_file(args.picture)
+    for count in args.faces:
+        faces = [FaceResult(fake_face(i)) for i in range(count)]
+        listofdetails = []
+        for face in faces:
+            listofdetails.extend(describe_face(face.raw))
+        box = pixel_boxes(faces, picture.size)
+
+        if not args.pil_only:
+            import matplotlib
+            matplotlib.use('Agg')
+            import matplotlib.pyplot as plt
+            from annotate import render_matplotlib
+
+            def render():
+                plt.close(render_matplotlib(picture, 'benchmark_render.jpg', box, listofdetails))
+            report('matplotlib %d faces' % count, timeit(render, args.rounds))
+        report('pil %d faces' % count,
+               timeit(lambda: render_pil(picture, 'benchmark_render.jpg', box, listofdetails), args.rounds))
+
+def benchmark_stream(args):
+    from streaming_transcribe import FakeTranscribeServer, StreamingTranscriber
+    frame_ms = 100
+    frame = b'\0' * (2 * 16000 * frame_ms // 1000)
+    with FakeTranscribeServer(delay=args.delay) as server:
+        for i in range(args.rounds):
+            times = {}
+
+            def frames():
+                times['start'] = time.perf_counter()
+                for n in range(int(args.seconds * 1000 / frame_ms)):
+                    yield frame
+                    time.sleep(frame_ms / 1000.0)
+                times['audio_end'] = time.perf_counter()
+
+            def partial(event):
+                times.setdefault('first_partial', time.perf_counter())
+
+            StreamingTranscriber(server.transport()).transcribe(frames(), on_partial=partial)
+            done = time.perf_counter()
+            print('%.1f s audio: first partial %6.1f ms after start, final %6.1f ms after audio ended' % (
+                args.seconds, (times['first_partial'] - times['start']) * 1000, (done - times['audio_end']) * 1000))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command')
+    capture = commands.add_parser('capture', help='camera capture latency')
+    capture.add_argument('--fake', help='picture file or directory used instead of the camera')
+    capture.add_argument('--rounds', type=int, default=10)
+    capture.set_defaults(run=benchmark_capture)
+    render = commands.add_parser('render', help='annotated picture rendering time per face count')
+    render.add_argument('picture')
+    render.add_argument('--faces', type=int, nargs='+', default=[1, 2, 4, 8])
+    render.add_argument('--rounds', type=int, default=3)
+    render.add_argument('--pil-only', action='store_true', help='skip matplotlib, e.g. when it is not installed')
+    render.set_defaults(run=benchmark_render)
+    stream = commands.add_parser('stream', help='streaming transcription latency against local fake server')
+    stream.add_argument('--seconds', type=float, default=3)
+    stream.add_argument('--delay', type=float, default=0.05, help='server processing time per reply')
+    stream.add_argument('--rounds', type=int, default=3)
+    stream.set_defaults(run=benchmark_stream)
+    args = parser.parse_args()
+    if not hasattr(args, 'run'):
+        parser.error('choose a benchmark')
+    args.run(args)
@@ -0,0 +1,86 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+class DetectionLog(object):
+    ''' Append-only JSON Lines log with one compact record per line.
+    Writes are buffered. When the file grows over max_bytes it is renamed to
+    path.1 (older ones to path.2 and so on) and a new file is started,
+    keeping at most backups old files. '''
+
+    def __init__(self, path='detections.jsonl', max_bytes=10 * 1024 * 1024, backups=5, buffer_size=64 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.buffer_size = buffer_size
+        self._file = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        self._file = open(self.path, 'a', buffering=self.buffer_size)
+        self._size = self._file.tell()
+
+    def append(self, record):
+        ''' Adds record to the log. Time is added to the record as 'time' if missing. '''
+        if 'time' not in record:
+            record = dict(record, time=round(time.time(), 3))
+        line = json.dumps(record, separators=(',', ':'), default=str) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._file.write(line)
+            self._size += len(line)
+            if self._size >= self.max_bytes:
+                self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists('%s.%d' % (self.path, n)):
+                os.replace('%s.%d' % (self.path, n), '%s.%d' % (self.path, n + 1))
+        if self.backups > 0:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __iter__(self):
+        self.flush()
+        return read_log(self.path, self.backups)
+
+def read_log(path, backups=5):
+    ''' Yields records of a log and its rotated files one at a time, oldest first. '''
+    paths = ['%s.%d' % (path, n) for n in range(backups, 0, -1)] + [path]
+    for logfile in paths:
+        if not os.path.exists(logfile):
+            continue
+        with open(logfile, 'r') as readfile:
+            for line in readfile:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+def get_log(path):
+    ''' Returns shared DetectionLog for path. Logs are flushed when program exits. '''
+    with _logs_lock:
+        if path not in _logs:
+            _logs[path] = DetectionLog(path)
+            atexit.register(_logs[path].close)
+        return _logs[path]
@@ -0,0 +1,81 @@
+import hashlib
+import io
+import threading
+# Pillow and numpy are imported when the picture is decoded
+
+class Frame(object):
+    ''' Picture shared by everything that sends, analyses or draws it.
+    Encoded bytes are kept for Rekognition and S3, and decoded once on first use,
+    so size, drawing, cropping and hashing do not reopen or copy the picture. '''
+
+    def __init__(self, data=None, image=None):
+        if data is None and image is None:
+            raise ValueError('Frame needs encoded data or an image')
+        self._data = bytes(data) if data is not None else None
+        self._image = image.convert('RGB') if image is not None else None
+        self._array = None
+        self._digest = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'rb') as file:
+            return cls(file.read())
+
+    @property
+    def data(self):
+        ''' Picture as JPEG bytes. '''
+        with self._lock:
+            if self._data is None:
+                stream = io.BytesIO()
+                self._image.save(stream, 'JPEG', quality=90)
+                self._data = stream.getvalue()
+            return self._data
+
+    @property
+    def image(self):
+        ''' Picture decoded as RGB Pillow image. Must not be modified or closed. '''
+        with self._lock:
+            if self._image is None:
+                from PIL import Image
+                with Image.open(io.BytesIO(self._data)) as img:
+                    self._image = img.convert('RGB')
+            return self._image
+
+    @property
+    def size(self):
+        return self.image.size
+
+    @property
+    def array(self):
+        ''' Picture as read-only numpy array of height x width x 3. '''
+        image = self.image
+        with self._lock:
+            if self._array is None:
+                import numpy as np
+                self._array = np.asarray(image)
+            return self._array
+
+    @property
+    def digest(self):
+        ''' SHA-256 of encoded picture, computed once. '''
+        data = self.data
+        with self._lock:
+            if self._digest is None:
+                self._digest = hashlib.sha256(data).hexdigest()
+            return self._digest
+
+    def crop(self, box):
+        ''' Returns part of the picture as Pillow image. Box is left, top, width
+        and height as ratios of picture size, like BoundingBox from Rekognition. '''
+        left, top, width, height = box
+        w, h = self.size
+        return self.image.crop((int(left*w), int(top*h), int((left+width)*w), int((top+height)*h)))
+
+def as_frame(kuvatiedosto):
+    ''' Returns Frame for a Frame, picture bytes or picture file on local drive. '''
+    if isinstance(kuvatiedosto, Frame):
+        return kuvatiedosto
+    if isinstance(kuvatiedosto, (bytes, bytearray)):
+        return Frame(kuvatiedosto)
+    return Frame.from_file(kuvatiedosto)
@@ -1,29 +1,30 @@
 # coding=utf-8
-from raspberrypi_picture import takepicture
-from raspberrypi_picture import upload_pict_to_s3
-from raspberrypi_picture import download_image_from_s3
-from rekognition import detectlabels
-from rekognition import show_original_picture
-from rekognition import detectfaces
-from rekognition import compare_faces
-from transcribe import start_transcribe
-from transcribe import get_response
-from transcribe import get_brutus_response
-from transcribe import get_job_status
-from transcribe import transcribe_brutus
+# Rekognition and Transcribe modules are imported in the commands using them
 from polly import turn_to_speech
 from polly import playresponse
+from polly import presynthesize
+from polly import speak_sentences
+from polly import split_sentences
+from polly import get_player
+from raspberrypi_picture import open_camera_async
 import os
 import datetime
-import time
-import vlc
 
-otettukuva='picture.jpg'
 kuva2='picture_with_box_around_face.jpg'
 target='master_to_be_recognised.jpg'
 bucket='<insert-your-s3-bucket-name-here>'
-textoutputfile = 'rekoresponse.txt'
-textoutputfile2 = 'rekoresponse2.txt'
+# Face collection for recognising many people, e.g. 'brutus-faces'.
+# If not set, faces are compared with the master's picture only.
+face_collection = None
+master = 'Andy'
+known_people = {master: [target]}
+# Upload pictures taken to S3 bucket in background, each under its own name.
+# Archived pictures can be analysed again with: python3 batch.py s3://<bucket>/captures/
+archive_pictures = True
+archive_prefix = 'captures/picture'
+# Detected labels and faces are appended to JSON Lines log
+textoutputfile = 'detections.jsonl'
+textoutputfile2 = 'detections.jsonl'
 mediaoutput = 'brutus_speaks.mp3'
 
 # Transcribe parameters, not currently used so they are commented out.
@@ -44,40 +45,81 @@ introduce = "introduce"
 nolegs = "legs"
 nolegs2 = "feet"
 
+# Synthesize canned responses in background, start audio player and warm up
+# the camera while waiting for a command
+presynthesize(split_sentences(introduction) + [whynolegs, processed, processed_noone])
+open_camera_async()
+get_player()
+
 komento = input("Issue a command: ")
 
 if introduce in komento:
     print("User asked to introduce myself.")
-    turn_to_speech(introduction,mediaoutput)
-    playresponse(mediaoutput)
+    speak_sentences(introduction)
 elif nolegs in komento or nolegs2 in komento:
     print("User is asking why I do not have legs.")
-    turn_to_speech(whynolegs,mediaoutput)
-    playresponse(mediaoutput)
+    playresponse(turn_to_speech(whynolegs))
 elif facial_properties in komento:
-    takepicture(otettukuva)
-    upload_pict_to_s3(otettukuva,bucket)
-    download_image_from_s3(bucket, target)
-    if compare_faces(bucket, otettukuva, target)>=80:
+    from raspberrypi_picture import get_camera
+    from raspberrypi_picture import archive_to_s3_async
+    from raspberrypi_picture import download_image_from_s3
+    from rekognition import detectlabels
+    from rekognition import show_original_picture
+    from rekognition import detectfaces
+    from rekognition import analyse_frame
+    from results import MatchResult
+    # Picture is kept in memory, sent to Rekognition as bytes and decoded once for drawing
+    otettukuva = get_camera().capture_frame()
+    if archive_pictures:
+        archive_to_s3_async(otettukuva.data, bucket,
+                            archive_prefix + datetime.datetime.now().strftime("%Y%m%d%H%M%S%f") + '.jpg')
+    if not os.path.exists(target):
+        download_image_from_s3(bucket, target)
+    # Face details and recognition are fetched at the same time. detectfaces
+    # below gets the face details from Rekognition result cache.
+    if face_collection:
+        from rekognition import enroll_faces
+        enroll_faces(face_collection, known_people)
+        analysis = analyse_frame(bucket, otettukuva, collection_id=face_collection)
+    else:
+        with open(target, 'rb') as file:
+            reference = file.read()
+        analysis = analyse_frame(bucket, otettukuva, reference=reference)
+        if analysis.match is not None:
+            analysis.match.person = master
+    match = analysis.match or MatchResult()
+    person = match.person
+    similarity = match.similarity
+    if similarity>=80 and person == master:
+        detectfaces(bucket, otettukuva, kuva2, textoutputfile2)
+        playresponse(turn_to_speech(processed))
+    elif similarity>=80:
         detectfaces(bucket, otettukuva, kuva2, textoutputfile2)
-        turn_to_speech(processed, mediaoutput)
-        playresponse(mediaoutput)
-    elif compare_faces(bucket, otettukuva, target)<80:
+        playresponse(turn_to_speech("I have recognised " + person + "."))
+    else:
         print("User not recognised. Details I am seeing:")
         detectfaces(bucket, otettukuva, kuva2, textoutputfile2)
         #detectlabels(bucket,otettukuva,textoutputfile)
         show_original_picture(otettukuva)
-        turn_to_speech(processed_noone, mediaoutput)
-        playresponse(mediaoutput)
+        playresponse(turn_to_speech(processed_noone))
 else:
     print(unknown)
-    turn_to_speech(processed_noone, mediaoutput)
-    playresponse(mediaoutput)
+    playresponse(turn_to_speech(processed_noone))
 
 # How to call Transcribe functions if microphone feed is implemented.
-#start_transcribe(job_name, audiourl)
-#transcribe_brutus(job,jobname_static,brutusresponse)
+#from transcribe import start_transcribe
+#from transcribe import transcribe_brutus
+#Trim silence locally before upload, so Transcribe gets only the speech:
+#from vad import prepare_for_upload
+#from raspberrypi_picture import upload_pict_to_s3
+#speechfiles, vadreport = prepare_for_upload('brutus_input.wav', split=False)
+#upload_pict_to_s3(speechfiles[0], bucket)
+#start_transcribe(job_name, 's3://%s/%s' % (bucket, speechfiles[0]), media_format='wav')
+#transcript = transcribe_brutus(job_name,jobname_static,brutusresponse)
+
+#if introduce in transcript.text:
+#    speak_sentences(introduction)
 
-#if introduce in str(get_brutus_response(brutusresponse)):
-#    turn_to_speech(introduction,mediaoutput)
-#    os.startfile(mediaoutput)
+# Streaming transcription answers about as soon as the command has been spoken:
+#from streaming_transcribe import AWSTransport, StreamingTranscriber, microphone_frames
+#transcript = StreamingTranscriber(AWSTransport()).transcribe(microphone_frames(seconds=4))
@@ -1,43 +1,196 @@
-import boto3
-import botocore
 from contextlib import closing
 import os
-import vlc
+import re
+import shutil
+import sys
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+import awsclients
+from speechcache import SpeechCache
 
-client = boto3.client('polly')
+speech_cache = SpeechCache()
 
-def turn_to_speech(input, outputfile):
-    ''' Fetches audiostream from AWS Polly, writes it as mp3 file.'''
-    response = client.synthesize_speech(
-        OutputFormat='mp3',
+# Synthesis jobs started by presynthesize, by cache key
+_inflight = {}
+_inflight_lock = threading.Lock()
+warmup_timings = {}
+
+# Sentence boundary: end punctuation followed by whitespace
+_sentence_end = re.compile(r'(?<=[.!?])\s+')
+
+_player = None
+_player_lock = threading.Lock()
+
+def get_client():
+    ''' Returns Polly client shared through awsclients. '''
+    return awsclients.client('polly')
+
+def turn_to_speech(input, outputfile=None, voice='Matthew', outputformat='mp3', engine='standard', use_cache=True):
+    ''' Fetches audiostream from AWS Polly, writes it as mp3 file.
+    Phrases already spoken are read from the local speech cache without calling Polly.
+    If the phrase is still being synthesized by warm-up, waits for that job instead.
+    Returns path to the audio file. If outputfile is given, audio is copied there too.
+    With use_cache=False audio is written to outputfile, or to a temporary file if not given. '''
+    key = SpeechCache.key(input, voice, outputformat, engine)
+    output = None
+    if use_cache:
+        with _inflight_lock:
+            job = _inflight.get(key)
+        if job is not None:
+            try:
+                output = job.result()
+            except Exception as error:
+                # Warm-up failed, try again below
+                print(error)
+    if output is None:
+        output = _synthesize(key, input, outputfile, voice, outputformat, engine, use_cache)
+
+    if output is not None and outputfile is not None and output != outputfile:
+        shutil.copyfile(output, outputfile)
+    print(input)
+    return output
+
+def _request_speech(input, voice, outputformat, engine):
+    return get_client().synthesize_speech(
+        Engine=engine,
+        OutputFormat=outputformat,
         Text=input,
         TextType='text',
-        VoiceId='Matthew'
+        VoiceId=voice
         )
 
-    if "AudioStream" in response:
+def _synthesize(key, input, outputfile, voice, outputformat, engine, use_cache):
+    ''' Returns cached audio file or calls Polly and stores the result. '''
+    output = speech_cache.get(key) if use_cache else None
+
+    if output is None:
+        response = _request_speech(input, voice, outputformat, engine)
+
+        if "AudioStream" in response:
+            with closing(response["AudioStream"]) as stream:
+                try:
+                    if use_cache:
+                        output = speech_cache.store(key, outputformat, iter(lambda: stream.read(65536), b''))
+                    else:
+                        output = outputfile
+                        if output is None:
+                            # Not cached and no file given, write to a temporary file
+                            handle, output = tempfile.mkstemp(suffix='.' + outputformat)
+                            os.close(handle)
+                        # Open a file for writing the output as a binary stream
+                        with open(output, "wb") as file:
+                            file.write(stream.read())
+                except IOError as error:
+                        # Could not write to file, exit gracefully
+                        print(error)
+                        sys.exit(-1)
+    return output
+
+def presynthesize(phrases, workers=4, voice='Matthew', outputformat='mp3', engine='standard'):
+    ''' Synthesizes phrases concurrently with a bounded thread pool, so they can be
+    played from the cache when needed. Time taken per phrase is printed and saved in
+    warmup_timings. Returns a dict of futures by phrase. '''
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = {}
+
+    def warmup(key, phrase):
+        start = time.time()
+        output = _synthesize(key, phrase, None, voice, outputformat, engine, True)
+        warmup_timings[phrase] = time.time() - start
+        print('Warm-up %.2f s: %s' % (warmup_timings[phrase], phrase[:40]))
+        return output
+
+    def finished(key):
+        def done(future):
+            with _inflight_lock:
+                if _inflight.get(key) is future:
+                    del _inflight[key]
+        return done
+
+    for phrase in phrases:
+        key = SpeechCache.key(phrase, voice, outputformat, engine)
+        with _inflight_lock:
+            future = _inflight.get(key)
+            if future is None:
+                future = executor.submit(warmup, key, phrase)
+                _inflight[key] = future
+        futures[phrase] = future
+        future.add_done_callback(finished(key))
+    executor.shutdown(wait=False)
+    return futures
+
+def get_player():
+    ''' Returns the shared AudioPlayer, creating it on first call. '''
+    global _player
+    with _player_lock:
+        if _player is None:
+            from audioplayer import AudioPlayer
+            _player = AudioPlayer()
+        return _player
+
+def playresponse(outputfile, block=True, timeout=None):
+    ''' Plays an mp3 file or audio bytes with the shared VLC player. Returns when
+    playback has ended, or at the latest after timeout seconds. With block=False
+    returns the Playback handle immediately, which can be waited on or cancelled. '''
+    return get_player().play(outputfile, block, timeout)
+
+def speak_streaming(input, voice='Matthew', outputformat='mp3', engine='standard', block=True, timeout=None):
+    ''' Plays speech from AWS Polly while the audio is still being downloaded.
+    The audio stream is passed to the player and saved to the speech cache
+    at the same time, so the next time the phrase is played from disk.
+    Returns the Playback handle. '''
+    key = SpeechCache.key(input, voice, outputformat, engine)
+    cached = speech_cache.get(key)
+    if cached is not None:
+        print(input)
+        return playresponse(cached, block, timeout)
+
+    response = _request_speech(input, voice, outputformat, engine)
+    if "AudioStream" not in response:
+        return None
+
+    def chunks():
         with closing(response["AudioStream"]) as stream:
-            output = outputfile
+            for chunk in iter(lambda: stream.read(4096), b''):
+                yield chunk
 
-            try:
-                # Open a file for writing the output as a binary stream
-                with open(output, "wb") as file:
-                    file.write(stream.read())
-            except IOError as error:
-                    # Could not write to file, exit gracefully
-                    print(error)
-                    sys.exit(-1)
     print(input)
+    return playresponse(speech_cache.tee(key, outputformat, chunks()), block, timeout)
+
+def split_sentences(input):
+    ''' Splits text into sentences. '''
+    return [sentence for sentence in _sentence_end.split(input.strip()) if sentence]
 
-def playresponse(outputfile):
-    ''' Opens VLC instance and plays mp3 file for 30 seconds. '''
-    instance = vlc.Instance()
-#Create a MediaPlayer with the default instance
-    player = instance.media_player_new()
-#Load the media file
-    media = instance.media_new(outputfile)
-#Add the media to the player
-    player.set_media(media)
-    player.play()
-    time.sleep(30)
+def speak_sentences(input, workers=3, voice='Matthew', outputformat='mp3', engine='standard'):
+    ''' Splits text into sentences, synthesizes them concurrently and plays them
+    in order, each as soon as it is ready. First audio is heard once the first
+    sentence is synthesized, not the whole text. If the first sentence is neither
+    cached nor being warmed up, it is streamed with speak_streaming so playback starts
+    before its download completes. Returns paths to the audio files. '''
+    sentences = split_sentences(input)
+    streamed = None
+    if sentences:
+        key = SpeechCache.key(sentences[0], voice, outputformat, engine)
+        with _inflight_lock:
+            warming = key in _inflight
+        if not warming and speech_cache.get(key) is None:
+            streamed = sentences.pop(0)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = [executor.submit(turn_to_speech, sentence, None, voice, outputformat, engine)
+               for sentence in sentences]
+    executor.shutdown(wait=False)
+    outputs = []
+    try:
+        if streamed is not None:
+            speak_streaming(streamed, voice, outputformat, engine)
+            outputs.append(speech_cache.path_for(key, outputformat))
+        for future in futures:
+            output = future.result()
+            playresponse(output)
+            outputs.append(output)
+    finally:
+        for future in futures:
+            future.cancel()
+    return outputs
@@ -1,23 +1,171 @@
-import picamera
-import boto3
-import botocore
+import io
+import os
+import atexit
+import threading
+import time
+import awsclients
+from frame import Frame
+# picamera is imported when first needed
+
+class CameraSession(object):
+    ''' Raspberry Pi camera kept open between pictures, so sensor initialisation
+    and exposure warm-up are done only once. Pictures can be captured to a file,
+    to bytes in memory or to a numpy array.
+    Requires camera to be set on in raspi-config. '''
+
+    def __init__(self, resolution=(1024, 768), warmup=2, use_video_port=False):
+        self.resolution = resolution
+        self.warmup = warmup
+        # Video port captures faster but with lower quality
+        self.use_video_port = use_video_port
+        self.camera = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        if self.camera is None:
+            import picamera
+            self.camera = picamera.PiCamera(resolution=self.resolution)
+            # Let automatic exposure and white balance settle
+            time.sleep(self.warmup)
+        return self
+
+    def close(self):
+        if self.camera is not None:
+            self.camera.close()
+            self.camera = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def capture(self, pict_name):
+        ''' Takes a picture and saves it as file. '''
+        with self._lock:
+            self.open().camera.capture(pict_name, use_video_port=self.use_video_port)
+
+    def capture_bytes(self, format='jpeg'):
+        ''' Takes a picture and returns it as encoded bytes. '''
+        stream = io.BytesIO()
+        with self._lock:
+            self.open().camera.capture(stream, format, use_video_port=self.use_video_port)
+        return stream.getvalue()
+
+    def capture_frame(self):
+        ''' Takes a picture and returns it as Frame, decoded only when needed. '''
+        return Frame(self.capture_bytes())
+
+    def capture_array(self):
+        ''' Takes a picture and returns it as RGB numpy array. '''
+        import picamera.array
+        with self._lock:
+            camera = self.open().camera
+            with picamera.array.PiRGBArray(camera) as output:
+                camera.capture(output, 'rgb', use_video_port=self.use_video_port)
+                return output.array
+
+class FakeCamera(object):
+    ''' Camera reading pictures from files, with the same interface as CameraSession.
+    Used for running and benchmarking without a Raspberry Pi camera.
+    Source is a picture file or a directory of pictures, which are returned in turn. '''
+
+    def __init__(self, source):
+        if os.path.isdir(source):
+            self.files = sorted(os.path.join(source, name) for name in os.listdir(source)
+                                if name.lower().endswith(('.jpg', '.jpeg', '.png')))
+        else:
+            self.files = [source]
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def open(self):
+        return self
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read(self):
+        with self._lock:
+            path = self.files[self._next % len(self.files)]
+            self._next += 1
+        with open(path, 'rb') as file:
+            return file.read()
+
+    def capture(self, pict_name):
+        with open(pict_name, 'wb') as file:
+            file.write(self._read())
+
+    def capture_bytes(self, format='jpeg'):
+        return self._read()
+
+    def capture_frame(self):
+        return Frame(self._read())
+
+    def capture_array(self):
+        from PIL import Image
+        import numpy as np
+        with Image.open(io.BytesIO(self._read())) as img:
+            return np.asarray(img.convert('RGB'))
+
+_camera = None
+_camera_lock = threading.Lock()
+
+def get_camera():
+    ''' Returns the shared camera session, opening it on first call. '''
+    global _camera
+    with _camera_lock:
+        if _camera is None:
+            _camera = CameraSession().open()
+            atexit.register(_camera.close)
+        return _camera
+
+def open_camera_async():
+    ''' Opens the shared camera session in background thread, so camera warm-up
+    happens while waiting for a command. get_camera() waits until it is open.
+    Returns the thread. '''
+    def open_camera():
+        try:
+            get_camera()
+        except Exception as error:
+            # get_camera() tries again and raises when the camera is needed
+            print(error)
+    opener = threading.Thread(target=open_camera)
+    opener.daemon = True
+    opener.start()
+    return opener
 
 def takepicture(pict_name):
     ''' Take a single picture with Raspberry Pi camera.
     Requires camera to be set on in raspi-config. '''
-    camera = picamera.PiCamera()
-    camera.capture(pict_name)
+    get_camera().capture(pict_name)
 
 def upload_pict_to_s3(pict_name, bucket_name):
     ''' Uploads a file to AWS S3 bucket.'''
-    s3 = boto3.resource('s3')
-    s3.Bucket(bucket_name).upload_file(pict_name, pict_name)
+    awsclients.client('s3').upload_file(pict_name, bucket_name, pict_name)
+
+def upload_bytes_to_s3(data, bucket_name, key):
+    ''' Uploads bytes from memory to AWS S3 bucket.'''
+    awsclients.client('s3').put_object(Body=data, Bucket=bucket_name, Key=key)
+
+def archive_to_s3_async(data, bucket_name, key):
+    ''' Uploads picture to S3 bucket in background thread, so analysis does not
+    wait for the upload. Returns the thread, which can be joined. '''
+    uploader = threading.Thread(target=upload_bytes_to_s3, args=(data, bucket_name, key))
+    uploader.start()
+    return uploader
 
 def download_image_from_s3(bucket, file):
-    ''' Downloads a file from AWS S3 bucket.'''    
-    s3 = boto3.resource('s3')
+    ''' Downloads a file from AWS S3 bucket.'''
+    import botocore
     try:
-        s3.Bucket(bucket).download_file(file, file)
+        awsclients.client('s3').download_file(bucket, file, file)
     except botocore.exceptions.ClientError as e:
         if e.response['Error']['Code'] == "404":
             print("The object does not exist.")
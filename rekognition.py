@@ -1,113 +1,316 @@
-import boto3
+import hashlib
 import json
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from PIL import Image #pip install Pillow
-import numpy as np
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import awsclients
+from resultcache import ResultCache
+from annotate import pixel_boxes, render_matplotlib, render_pil
+from frame import Frame, as_frame
+from results import FaceResult, LabelResult, MatchResult
+from detectionlog import get_log
 
-client=boto3.client('rekognition','eu-west-1')
+# Heavy libraries (matplotlib, numpy, Pillow) are imported in the functions using them
+
+# Responses by hash of operation, pictures and parameters
+results = ResultCache(max_entries=64, ttl=300)
+
+# Optional rate limiter with acquire(), called before each request to Rekognition
+rate_limiter = None
+
+# Names of enrolled people by ExternalImageId, which allows only some characters
+enrolled_names = {}
+
+# Threads for running analyses of a picture at the same time
+_executor = ThreadPoolExecutor(max_workers=4)
+
+def get_client():
+    ''' Returns Rekognition client shared through awsclients. '''
+    return awsclients.client('rekognition', 'eu-west-1')
+
+def _cache_key(operation, params):
+    ''' Returns hash of operation and its parameters. Picture bytes are hashed by
+    content, so the same picture gives the same key. '''
+    def normalise(value):
+        if isinstance(value, Frame):
+            return 'sha256:' + value.digest
+        if isinstance(value, (bytes, bytearray)):
+            return 'sha256:' + hashlib.sha256(value).hexdigest()
+        if isinstance(value, dict):
+            return dict((k, normalise(v)) for k, v in value.items())
+        if isinstance(value, (list, tuple)):
+            return [normalise(v) for v in value]
+        return value
+    key = json.dumps([operation, normalise(params)], sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def _encoded(value):
+    ''' Replaces Frames in parameters with their encoded bytes. '''
+    if isinstance(value, Frame):
+        return value.data
+    if isinstance(value, dict):
+        return dict((k, _encoded(v)) for k, v in value.items())
+    return value
+
+def _refers_to_s3(value):
+    ''' Returns True if parameters refer to a picture in S3 bucket. '''
+    if isinstance(value, dict):
+        return 'S3Object' in value or any(_refers_to_s3(v) for v in value.values())
+    return False
+
+def call_rekognition(operation, **params):
+    ''' Calls Rekognition operation, or returns cached response of an identical earlier call.
+    Calls with pictures in S3 are not cached, as an object can be replaced under the same name. '''
+    key = None if _refers_to_s3(params) else _cache_key(operation, params)
+    response = results.get(key) if key is not None else None
+    if response is None:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        response = getattr(get_client(), operation)(**_encoded(params))
+        if key is not None:
+            results.put(key, response)
+    return response
+
+def image_param(s3bucket, kuvatiedosto):
+    ''' Returns Image parameter for Rekognition. Picture is given either as Frame or bytes,
+    which are sent with the request, or as name of an object in S3 bucket. '''
+    if isinstance(kuvatiedosto, Frame):
+        # Frame is kept in the parameter so cache key uses its precomputed hash
+        return {'Bytes': kuvatiedosto}
+    if isinstance(kuvatiedosto, (bytes, bytearray)):
+        return {'Bytes': bytes(kuvatiedosto)}
+    return {'S3Object': {'Bucket': s3bucket, 'Name': kuvatiedosto}}
+
+def detect_labels(s3bucket, kuvatiedosto):
+    ''' Returns labels Rekognition detected in a picture as LabelResults. '''
+    response = call_rekognition('detect_labels', Image=image_param(s3bucket, kuvatiedosto))
+    return [LabelResult.from_response(label) for label in response['Labels']]
+
+def detect_faces(s3bucket, kuvatiedosto):
+    ''' Returns faces Rekognition detected in a picture as FaceResults. '''
+    response = call_rekognition('detect_faces', Image=image_param(s3bucket, kuvatiedosto), Attributes=['ALL'])
+    return [FaceResult(faceDetail) for faceDetail in response['FaceDetails']]
+
+def picture_id(kuvatiedosto):
+    ''' Returns identifier of a picture for logs: hash of Frame or bytes, or object name. '''
+    if isinstance(kuvatiedosto, Frame):
+        return 'sha256:' + kuvatiedosto.digest
+    if isinstance(kuvatiedosto, (bytes, bytearray)):
+        return 'sha256:' + hashlib.sha256(kuvatiedosto).hexdigest()
+    return kuvatiedosto
 
 def detectlabels(s3bucket,kuvatiedosto,textoutputfile):
     ''' Fetches response from AWS Rekognition about detected labels
-    in a picture and writes the output to an outputfile.  '''
-    response = client.detect_labels(Image={'S3Object':{'Bucket':s3bucket,'Name':kuvatiedosto}})
-    outputfile = open(textoutputfile, 'w')
-    for label in response['Labels']:
-        outputfile.write(label['Name']+ ": " + str(label['Confidence']))
-        outputfile.write("\n")
-    outputfile.close()
-    for label in response['Labels']:
-        print(label['Name']+ ": " + str(label['Confidence']))
+    in a picture and appends them as one record to JSON Lines log textoutputfile.
+    Returns the labels. Picture is Frame, bytes or name of an object in S3 bucket. '''
+    labels = detect_labels(s3bucket, kuvatiedosto)
+    get_log(textoutputfile).append({'picture': picture_id(kuvatiedosto),
+                                    'labels': [[label.name, label.confidence] for label in labels]})
+    for label in labels:
+        print(label.name+ ": " + str(label.confidence))
+    return labels
 
 def show_original_picture(kuvatiedosto):
     ''' Simple function to open a picture from local drive.
     Uses Pillow library, might require installing Imagemagick.'''
-    img = Image.open(kuvatiedosto)
-    img.show()
+    as_frame(kuvatiedosto).image.show()
 
 def compare_faces(s3bucket, sourceimage, targetimage):
-    ''' Compares faces in two images, returns confidence level of the two having the same face in the image.'''
-    response = client.compare_faces(
-        SourceImage={
-            'S3Object': {
-                'Bucket': s3bucket,
-                'Name': sourceimage
-            }
-        },
-        TargetImage={
-            'S3Object': {
-                'Bucket': s3bucket,
-                'Name': targetimage
-            }
-        },
+    ''' Compares faces in two images, returns MatchResult with confidence level of the two having the same face in the image.
+    Images are Frames, bytes or names of objects in S3 bucket.'''
+    response = call_rekognition('compare_faces',
+        SourceImage=image_param(s3bucket, sourceimage),
+        TargetImage=image_param(s3bucket, targetimage),
         SimilarityThreshold=0.7
     )
     for detail in response['FaceMatches']:
         if detail['Similarity'] is not None:
-            return float(detail['Similarity'])
+            return MatchResult(float(detail['Similarity']), face_id=detail['Face'].get('FaceId'))
         else:
-            return 0
-
-def detectfaces(s3bucket,kuvatiedosto,kuvatiedosto2,textoutputfile2):
-    ''' Detects faces in image, returns details of face as outputfile and
-    draws a box around the first image detected in the image. Writes details in the image also. '''
-    global listofdetails
-    global imwidth
-    global imheight
-    global imleft
-    global imtop
-
-    response = client.detect_faces(Image={'S3Object':{'Bucket':s3bucket,'Name':kuvatiedosto}},Attributes=['ALL'])
-    outputfile2 = open(textoutputfile2, 'w')
-    for faceDetail in response['FaceDetails']:
-        outputfile2.write(json.dumps(faceDetail, indent=4, sort_keys=True))
-    outputfile2.close()
+            return MatchResult()
+    return MatchResult()
+
+def create_collection(collection_id):
+    ''' Creates Rekognition face collection, if it does not exist yet. '''
+    client = get_client()
+    try:
+        client.create_collection(CollectionId=collection_id)
+    except client.exceptions.ResourceAlreadyExistsException:
+        pass
+
+def enroll_faces(collection_id, people, recordfile='enrolled_faces.json'):
+    ''' Indexes reference pictures of known people into face collection.
+    People is a dict of person name and list of picture files on local drive.
+    Pictures already indexed are listed in recordfile and skipped, so this can
+    be called on every startup without calls to Rekognition. Returns number of faces indexed. '''
+    try:
+        with open(recordfile, 'r') as readfile:
+            enrolled = json.load(readfile)
+    except (IOError, ValueError):
+        enrolled = {}
+    indexed = 0
+    created = False
+    for person, pictures in people.items():
+        # Only letters, numbers and _.-: are allowed in ExternalImageId
+        externalid = ''.join(c if c.isalnum() or c in '_.-:' else '_' for c in person)
+        enrolled_names[externalid] = person
+        for picture in pictures:
+            with open(picture, 'rb') as file:
+                data = file.read()
+            digest = collection_id + ':' + hashlib.sha256(data).hexdigest()
+            if digest in enrolled:
+                continue
+            if not created:
+                create_collection(collection_id)
+                created = True
+            response = get_client().index_faces(
+                CollectionId=collection_id,
+                Image={'Bytes': data},
+                ExternalImageId=externalid,
+                MaxFaces=1,
+                QualityFilter='AUTO'
+            )
+            enrolled[digest] = [record['Face']['FaceId'] for record in response['FaceRecords']]
+            indexed += len(response['FaceRecords'])
+    if created:
+        with open(recordfile, 'w') as writefile:
+            json.dump(enrolled, writefile)
+        # Searches made before enrolling may now have different results
+        results.clear()
+    return indexed
+
+def identify_person(collection_id, s3bucket, kuvatiedosto, threshold=80):
+    ''' Searches face collection for the largest face in picture with one call,
+    no matter how many people are enrolled. Returns MatchResult with name of the
+    person and similarity, or empty MatchResult if nobody was recognised. '''
+    client = get_client()
+    try:
+        response = call_rekognition('search_faces_by_image',
+            CollectionId=collection_id,
+            Image=image_param(s3bucket, kuvatiedosto),
+            FaceMatchThreshold=threshold,
+            MaxFaces=1
+        )
+    except client.exceptions.InvalidParameterException:
+        # No face found in picture
+        return MatchResult()
+    for match in response['FaceMatches']:
+        externalid = match['Face'].get('ExternalImageId')
+        return MatchResult(float(match['Similarity']), enrolled_names.get(externalid, externalid), match['Face'].get('FaceId'))
+    return MatchResult()
+
+class FrameAnalysis(object):
+    ''' Merged results of analyses run for one picture: lists of FaceResults and
+    LabelResults and a MatchResult. Analyses that failed are in errors, ones that
+    did not finish before the deadline in missing. '''
+    __slots__ = ('faces', 'labels', 'match', 'errors', 'missing', 'elapsed')
+
+    def __init__(self):
+        self.faces = None
+        self.labels = None
+        self.match = None
+        self.errors = {}
+        self.missing = []
+        self.elapsed = 0
+
+    def complete(self):
+        return not self.errors and not self.missing
+
+    def to_record(self, picture):
+        ''' Returns results as a dict for DetectionLog. '''
+        record = {'picture': picture, 'elapsed': round(self.elapsed, 3)}
+        if self.faces is not None:
+            record['faces'] = [face.raw for face in self.faces]
+        if self.labels is not None:
+            record['labels'] = [[label.name, label.confidence] for label in self.labels]
+        if self.match is not None:
+            record['match'] = [self.match.person, self.match.similarity]
+        if self.errors:
+            record['errors'] = dict((name, str(error)) for name, error in self.errors.items())
+        if self.missing:
+            record['missing'] = self.missing
+        return record
+
+def analyse_frame(s3bucket, kuvatiedosto, reference=None, collection_id=None,
+                  faces=True, labels=False, deadline=10, textoutputfile=None):
+    ''' Runs Rekognition analyses of a picture concurrently and merges the results,
+    so the time taken is that of the slowest call. Faces are compared with the
+    reference picture, or searched from face collection if collection_id is given.
+    Calls not finished in deadline seconds are left out of the result.
+    If textoutputfile is given, results are appended to it as one JSON Lines record. '''
+    start = time.time()
+    analysis = FrameAnalysis()
+    calls = {}
+    if faces:
+        calls['faces'] = _executor.submit(detect_faces, s3bucket, kuvatiedosto)
+    if labels:
+        calls['labels'] = _executor.submit(detect_labels, s3bucket, kuvatiedosto)
+    if collection_id is not None:
+        calls['match'] = _executor.submit(identify_person, collection_id, s3bucket, kuvatiedosto)
+    elif reference is not None:
+        calls['match'] = _executor.submit(compare_faces, s3bucket, kuvatiedosto, reference)
+
+    wait(list(calls.values()), timeout=deadline)
+    for name, call in calls.items():
+        if not call.done():
+            call.cancel()
+            analysis.missing.append(name)
+        elif call.exception() is not None:
+            analysis.errors[name] = call.exception()
+        else:
+            setattr(analysis, name, call.result())
+    analysis.elapsed = time.time() - start
+    if textoutputfile is not None:
+        get_log(textoutputfile).append(analysis.to_record(picture_id(kuvatiedosto)))
+    return analysis
+
+def describe_face(faceDetail):
+    ''' Returns details of a face from Rekognition as lines of text. '''
+    listofdetails = []
+    listofdetails.append('Approximate age: ')
+    listofdetails.append('    ' + str(faceDetail['AgeRange']['Low']) + '-' + str(faceDetail['AgeRange']['High']) + ' years')
+    listofdetails.append('Beard: ')
+    listofdetails.append('    ' + str(faceDetail['Beard']))
+    listofdetails.append('Mustache: ')
+    listofdetails.append('    ' + str(faceDetail['Mustache']))
+    listofdetails.append('Emotions: ')
+    for i in range(0,len(faceDetail['Emotions'])):
+        listofdetails.append('    ' + str(faceDetail['Emotions'][i]))
+    listofdetails.append('Smile: ')
+    listofdetails.append('    ' + str((faceDetail['Smile'])))
+    listofdetails.append('Eyeglasses: ')
+    listofdetails.append('    ' + str(faceDetail['Eyeglasses']))
+    listofdetails.append('Sunglasses: ')
+    listofdetails.append('    ' + str(faceDetail['Sunglasses']))
+    listofdetails.append('EyesOpen: ')
+    listofdetails.append('    ' + str(faceDetail['EyesOpen']))
+    listofdetails.append('Gender: ')
+    listofdetails.append('    ' + str(faceDetail['Gender']))
+    return listofdetails
+
+def detectfaces(s3bucket,kuvatiedosto,kuvatiedosto2,textoutputfile2,renderer='pil',show=True):
+    ''' Detects faces in image, returns them as FaceResults. Appends details of faces as one record to JSON Lines log textoutputfile2 and
+    draws a numbered box around every face detected in the image. Writes details in the image also.
+    Picture is Frame, bytes or name of an object in S3 bucket that is also found on local drive.
+    Renderer is 'pil' or 'matplotlib', show=False keeps the picture off the screen. '''
+    faces = detect_faces(s3bucket, kuvatiedosto)
+    get_log(textoutputfile2).append({'picture': picture_id(kuvatiedosto),
+                                     'faces': [face.raw for face in faces]})
 
     listofdetails = []
-    for faceDetail in response['FaceDetails']:
-        listofdetails.append('Approximate age: ')
-        listofdetails.append('    ' + str(faceDetail['AgeRange']['Low']) + '-' + str(faceDetail['AgeRange']['High']) + ' years')
-        listofdetails.append('Beard: ')
-        listofdetails.append('    ' + str(faceDetail['Beard']))
-        listofdetails.append('Mustache: ')
-        listofdetails.append('    ' + str(faceDetail['Mustache']))
-        listofdetails.append('Emotions: ')
-        for i in range(0,len(faceDetail['Emotions'])):
-            listofdetails.append('    ' + str(faceDetail['Emotions'][i]))
-        listofdetails.append('Smile: ')
-        listofdetails.append('    ' + str((faceDetail['Smile'])))
-        listofdetails.append('Eyeglasses: ')
-        listofdetails.append('    ' + str(faceDetail['Eyeglasses']))
-        listofdetails.append('Sunglasses: ')
-        listofdetails.append('    ' + str(faceDetail['Sunglasses']))
-        listofdetails.append('EyesOpen: ')
-        listofdetails.append('    ' + str(faceDetail['EyesOpen']))
-        listofdetails.append('Gender: ')
-        listofdetails.append('    ' + str(faceDetail['Gender']))
-
-    # Get bounding box parameters for image manipulation
-        imwidth  = faceDetail['BoundingBox']['Width']
-        imheight = faceDetail['BoundingBox']['Height']
-        imleft   = faceDetail['BoundingBox']['Left']
-        imtop    = faceDetail['BoundingBox']['Top']
-
-    # Open picture and display box on detected face:
-    with Image.open(kuvatiedosto) as img:
-        width,height = img.size
-
-        img = np.array(Image.open(kuvatiedosto), dtype=np.uint8)
-    # Create figure and axes
-        fig,ax = plt.subplots(1)
-    # Display the image
-        ax.imshow(img)
-
-    # Create a Rectangle patch
-        rect = patches.Rectangle((imleft*width,imtop*height),imwidth*width,imheight*height,linewidth=1,edgecolor='b',facecolor='none')
-
-    # Add the patch to the Axes and insert text from Rekognition
-        ax.add_patch(rect)
-        dpi=300
-        for j in range(0,len(listofdetails)):
-            plt.text((width+50),height/4+j*75,listofdetails[j],fontsize=7)
-            plt.savefig(kuvatiedosto2, orientation='portrait', figsize=(width/dpi,height/dpi), dpi = dpi)
-    plt.show()
+    for n, face in enumerate(faces):
+        listofdetails.append('Face ' + str(n + 1))
+        listofdetails.extend(describe_face(face.raw))
+
+    # Bounding boxes of all faces in pixels, drawn in one render
+    frame = as_frame(kuvatiedosto)
+    boxes = pixel_boxes(faces, frame.size)
+    if renderer == 'matplotlib':
+        render_matplotlib(frame, kuvatiedosto2, boxes, listofdetails)
+        if show:
+            import matplotlib.pyplot as plt
+            plt.show()
+    else:
+        img = render_pil(frame, kuvatiedosto2, boxes, listofdetails)
+        if show:
+            img.show()
+    return faces
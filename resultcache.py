@@ -0,0 +1,45 @@
+import threading
+import time
+from collections import OrderedDict
+
+class ResultCache(object):
+    ''' In-memory cache for service responses, with time to live and maximum size.
+    Oldest used entries are removed when the cache is full. '''
+
+    def __init__(self, max_entries=128, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> (expiry time, value), oldest use first
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        ''' Returns cached value, or None if key is not cached or has expired. '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
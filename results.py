@@ -0,0 +1,104 @@
+''' Result types returned by rekognition and transcribe functions.
+Each call creates new objects, so results can be produced from parallel workers
+without shared state. Slots keep them small and cheap to create for every picture. '''
+
+class _Result(object):
+    __slots__ = ()
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__,
+                           ', '.join('%s=%r' % (name, getattr(self, name)) for name in self.__slots__
+                                     if name != 'raw'))
+
+class FaceResult(_Result):
+    ''' Face found by DetectFaces. Box is left, top, width and height as ratios of
+    picture size. Raw is the FaceDetail from Rekognition. '''
+    __slots__ = ('box', 'confidence', 'age_low', 'age_high', 'gender', 'emotion',
+                 'smile', 'eyeglasses', 'sunglasses', 'beard', 'mustache', 'eyes_open', 'raw')
+
+    def __init__(self, faceDetail):
+        box = faceDetail['BoundingBox']
+        self.box = (box['Left'], box['Top'], box['Width'], box['Height'])
+        self.confidence = faceDetail.get('Confidence')
+        agerange = faceDetail.get('AgeRange', {})
+        self.age_low = agerange.get('Low')
+        self.age_high = agerange.get('High')
+        self.gender = faceDetail.get('Gender', {}).get('Value')
+        emotions = faceDetail.get('Emotions') or [{}]
+        # Most confident emotion
+        self.emotion = max(emotions, key=lambda e: e.get('Confidence', 0)).get('Type')
+        self.smile = _value(faceDetail, 'Smile')
+        self.eyeglasses = _value(faceDetail, 'Eyeglasses')
+        self.sunglasses = _value(faceDetail, 'Sunglasses')
+        self.beard = _value(faceDetail, 'Beard')
+        self.mustache = _value(faceDetail, 'Mustache')
+        self.eyes_open = _value(faceDetail, 'EyesOpen')
+        self.raw = faceDetail
+
+class LabelResult(_Result):
+    ''' Label found by DetectLabels. '''
+    __slots__ = ('name', 'confidence', 'parents')
+
+    def __init__(self, name, confidence, parents=()):
+        self.name = name
+        self.confidence = confidence
+        self.parents = tuple(parents)
+
+    @classmethod
+    def from_response(cls, label):
+        return cls(label['Name'], label['Confidence'], [parent['Name'] for parent in label.get('Parents', [])])
+
+class MatchResult(_Result):
+    ''' Result of comparing a face with a reference or searching a face collection.
+    Person is None when faces were compared with a single reference picture. '''
+    __slots__ = ('similarity', 'person', 'face_id')
+
+    def __init__(self, similarity=0, person=None, face_id=None):
+        self.similarity = similarity
+        self.person = person
+        self.face_id = face_id
+
+    def matched(self, threshold=80):
+        return self.similarity >= threshold
+
+class WordResult(_Result):
+    ''' Word or punctuation in a transcript. Times are seconds from start of the
+    audio, None for punctuation. '''
+    __slots__ = ('content', 'start', 'end', 'confidence')
+
+    def __init__(self, content, start=None, end=None, confidence=None):
+        self.content = content
+        self.start = start
+        self.end = end
+        self.confidence = confidence
+
+class TranscriptResult(_Result):
+    ''' Text Transcribe recognised in an audio file, with WordResults. '''
+    __slots__ = ('job_name', 'text', 'words')
+
+    def __init__(self, text, job_name=None, words=()):
+        self.text = text
+        self.job_name = job_name
+        self.words = tuple(words)
+
+    def confidence(self):
+        ''' Returns lowest confidence of the words, or None if there are no words. '''
+        confidences = [word.confidence for word in self.words if word.start is not None]
+        return min(confidences) if confidences else None
+
+    def __str__(self):
+        return 'Command given: ' + self.text
+
+class TranscriptEvent(_Result):
+    ''' Transcript from streaming transcription. Partial transcripts may still
+    change, a final one is the settled text of a segment of speech. '''
+    __slots__ = ('text', 'is_partial', 'start', 'end')
+
+    def __init__(self, text, is_partial, start=None, end=None):
+        self.text = text
+        self.is_partial = is_partial
+        self.start = start
+        self.end = end
+
+def _value(faceDetail, attribute):
+    return faceDetail.get(attribute, {}).get('Value')
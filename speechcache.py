@@ -0,0 +1,144 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# File extensions for Polly output formats
+EXTENSIONS = {'mp3': '.mp3', 'ogg_vorbis': '.ogg', 'pcm': '.pcm'}
+
+class SpeechCache(object):
+    ''' Content-addressed disk cache for audio synthesized with Polly.
+    Files are named by a hash of text, voice, output format and engine.
+    When the cache grows over max_bytes, least recently used files are removed. '''
+
+    def __init__(self, directory='polly_cache', max_bytes=50 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> (path, size), oldest use first
+        self._entries = OrderedDict()
+        self._size = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._load()
+
+    def _load(self):
+        ''' Reads existing cache files, file modification time is used as last use time. '''
+        found = []
+        for name in os.listdir(self.directory):
+            key, ext = os.path.splitext(name)
+            path = os.path.join(self.directory, name)
+            if ext == '.part':
+                self._remove_stale(path)
+                continue
+            if ext not in EXTENSIONS.values():
+                continue
+            stat = os.stat(path)
+            found.append((stat.st_mtime, key, path, stat.st_size))
+        for mtime, key, path, size in sorted(found):
+            self._entries[key] = (path, size)
+            self._size += size
+        self._evict()
+
+    @staticmethod
+    def _remove_stale(path):
+        ''' Removes a temporary file left by a process that exited while writing it.
+        Files of running processes are kept, they may share the cache directory. '''
+        try:
+            pid = int(path.rsplit('.', 3)[1])
+            if pid != os.getpid():
+                os.kill(pid, 0)
+                return
+        except (ValueError, IndexError, ProcessLookupError):
+            pass
+        except OSError:
+            # Process exists but belongs to another user
+            return
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def key(text, voice, outputformat, engine):
+        ''' Returns cache key for given synthesis parameters. '''
+        digest = hashlib.sha256()
+        for part in (text, voice, outputformat, engine):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key):
+        ''' Returns path to cached audio file, or None if key is not cached. '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not os.path.exists(entry[0]):
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        try:
+            # Keep recency over restarts
+            os.utime(entry[0], None)
+        except OSError:
+            pass
+        return entry[0]
+
+    def path_for(self, key, outputformat):
+        ''' Returns path where audio for key is stored. '''
+        return os.path.join(self.directory, key + EXTENSIONS.get(outputformat, '.' + outputformat))
+
+    def store(self, key, outputformat, chunks):
+        ''' Writes chunks of audio into the cache and returns path to the file. '''
+        for chunk in self.tee(key, outputformat, chunks):
+            pass
+        return self.path_for(key, outputformat)
+
+    def tee(self, key, outputformat, chunks):
+        ''' Generator that writes chunks into the cache while passing them on,
+        so audio can be played and cached at the same time.
+        File is written under a temporary name and renamed when complete,
+        so a half-written file is never served. '''
+        path = self.path_for(key, outputformat)
+        temp = '%s.%d.%d.part' % (path, os.getpid(), threading.get_ident())
+        size = 0
+        try:
+            with open(temp, 'wb') as file:
+                for chunk in chunks:
+                    file.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            os.replace(temp, path)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries[key][1]
+            self._entries[key] = (path, size)
+            self._entries.move_to_end(key)
+            self._size += size
+            self._evict()
+
+    def _drop(self, key):
+        path, size = self._entries.pop(key)
+        self._size -= size
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        # Newest entry is always kept, even if it alone is over the limit
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)))
+
+    def stats(self):
+        ''' Returns hit and miss counters and current size of the cache. '''
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self._entries), 'bytes': self._size}
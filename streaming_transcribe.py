@@ -0,0 +1,307 @@
+''' Streaming speech to text. Audio frames are sent while they are recorded and
+transcripts come back while the person is still talking, instead of uploading
+a finished recording and waiting for a batch Transcribe job.
+
+The service is reached through a transport: AWSTransport for Amazon Transcribe
+streaming, or SocketTransport together with FakeTranscribeServer for running
+locally, in tests and benchmarks. '''
+import json
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+import wave
+from results import TranscriptEvent, TranscriptResult
+
+class Transport(object):
+    ''' Connection to a streaming transcription service. '''
+
+    def start(self, sample_rate):
+        ''' Opens a stream for 16-bit mono PCM audio at sample_rate. '''
+        raise NotImplementedError
+
+    def send(self, frame):
+        ''' Sends a frame of PCM audio. '''
+        raise NotImplementedError
+
+    def end(self):
+        ''' Tells the service that no more audio is coming. '''
+        raise NotImplementedError
+
+    def events(self):
+        ''' Yields TranscriptEvents until the stream has ended. '''
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class AWSTransport(Transport):
+    ''' Amazon Transcribe streaming through the amazon-transcribe package
+    (pip install amazon-transcribe). Its asyncio client runs in its own thread. '''
+
+    def __init__(self, region='eu-west-1', language_code='en-US'):
+        self.region = region
+        self.language_code = language_code
+        self._loop = None
+        self._stream = None
+        self._events = queue.Queue()
+
+    def _call(self, coroutine):
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def start(self, sample_rate):
+        import asyncio
+        from amazon_transcribe.client import TranscribeStreamingClient
+        self._loop = asyncio.new_event_loop()
+        runner = threading.Thread(target=self._loop.run_forever)
+        runner.daemon = True
+        runner.start()
+        client = TranscribeStreamingClient(region=self.region)
+        self._stream = self._call(client.start_stream_transcription(
+            language_code=self.language_code,
+            media_sample_rate_hz=sample_rate,
+            media_encoding='pcm'))
+        asyncio.run_coroutine_threadsafe(self._read(), self._loop)
+
+    async def _read(self):
+        try:
+            async for event in self._stream.output_stream:
+                for result in event.transcript.results:
+                    if result.alternatives:
+                        self._events.put(TranscriptEvent(result.alternatives[0].transcript,
+                                                         result.is_partial, result.start_time, result.end_time))
+        except Exception as error:
+            self._events.put(error)
+        self._events.put(None)
+
+    def send(self, frame):
+        self._call(self._stream.input_stream.send_audio_event(audio_chunk=frame))
+
+    def end(self):
+        self._call(self._stream.input_stream.end_stream())
+
+    def events(self):
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            if isinstance(event, Exception):
+                raise event
+            yield event
+
+    def close(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+# SocketTransport and FakeTranscribeServer talk over TCP: messages go to the
+# server prefixed with 4-byte length. First message is the sample rate, then
+# audio frames, and a zero length ends the audio. Events come back as lines of JSON.
+
+class SocketTransport(Transport):
+    ''' Transport to a FakeTranscribeServer, or any server speaking the same protocol. '''
+
+    def __init__(self, address):
+        self.address = address
+        self._socket = None
+        self._reader = None
+
+    def start(self, sample_rate):
+        self._socket = socket.create_connection(self.address)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._socket.makefile('r')
+        self._socket.sendall(struct.pack('>I', 4) + struct.pack('>I', sample_rate))
+
+    def send(self, frame):
+        self._socket.sendall(struct.pack('>I', len(frame)) + frame)
+
+    def end(self):
+        self._socket.sendall(struct.pack('>I', 0))
+
+    def events(self):
+        for line in self._reader:
+            data = json.loads(line)
+            yield TranscriptEvent(data['text'], data['partial'], data.get('start'), data.get('end'))
+            if not data['partial']:
+                return
+
+    def close(self):
+        if self._socket is not None:
+            self._reader.close()
+            self._socket.close()
+            self._socket = None
+
+class FakeTranscribeServer(object):
+    ''' Local stand-in for streaming transcription. Reveals the words of a
+    scripted transcript as partial results, one word per frames_per_word frames
+    of audio, and sends the whole transcript as final result when audio ends.
+    Delay adds processing time in seconds before each reply. '''
+
+    def __init__(self, transcript='Brutus, introduce yourself.', frames_per_word=3, delay=0,
+                 host='127.0.0.1', port=0):
+        self.transcript = transcript
+        self.frames_per_word = frames_per_word
+        self.delay = delay
+        self._server = socketserver.ThreadingTCPServer((host, port), _FakeHandler, bind_and_activate=False)
+        self._server.allow_reuse_address = True
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        self._server.server_bind()
+        self._server.server_activate()
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def transport(self):
+        ''' Returns a transport connected to this server. '''
+        return SocketTransport(self.address)
+
+class _FakeHandler(socketserver.BaseRequestHandler):
+
+    def _receive(self, length):
+        data = b''
+        while len(data) < length:
+            chunk = self.request.recv(length - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def _reply(self, text, partial, end):
+        fake = self.server.fake
+        if fake.delay:
+            time.sleep(fake.delay)
+        line = json.dumps({'text': text, 'partial': partial, 'start': 0.0, 'end': round(end, 3)}) + '\n'
+        self.request.sendall(line.encode('utf-8'))
+
+    def handle(self):
+        fake = self.server.fake
+        words = fake.transcript.split()
+        header = self._receive(8)
+        if header is None:
+            return
+        sample_rate = struct.unpack('>I', header[4:])[0]
+        frames = 0
+        audiobytes = 0
+        shown = 0
+        while True:
+            length = self._receive(4)
+            if length is None:
+                return
+            length = struct.unpack('>I', length)[0]
+            if length == 0:
+                break
+            if self._receive(length) is None:
+                return
+            frames += 1
+            audiobytes += length
+            if frames % fake.frames_per_word == 0 and shown < len(words):
+                shown += 1
+                self._reply(' '.join(words[:shown]), True, audiobytes / 2.0 / sample_rate)
+        self._reply(fake.transcript, False, audiobytes / 2.0 / sample_rate)
+
+class StreamingTranscriber(object):
+    ''' Sends audio frames to a transport while they are produced and yields
+    partial and final transcripts as they arrive. '''
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def stream(self, frames, sample_rate=16000):
+        ''' Generator of TranscriptEvents for frames of 16-bit mono PCM audio.
+        Frames are sent from a background thread, so recording is not held up
+        by the network. If reading or sending frames fails, the error is raised
+        after the events received so far, so a cut off command is not taken as complete. '''
+        self.transport.start(sample_rate)
+        stop = threading.Event()
+        errors = []
+
+        def send():
+            try:
+                for frame in frames:
+                    if stop.is_set():
+                        break
+                    if frame:
+                        self.transport.send(frame)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                if not stop.is_set():
+                    try:
+                        self.transport.end()
+                    except Exception as error:
+                        errors.append(error)
+
+        sender = threading.Thread(target=send)
+        sender.daemon = True
+        sender.start()
+        try:
+            for event in self.transport.events():
+                yield event
+        finally:
+            stop.set()
+            sender.join()
+            self.transport.close()
+        if errors:
+            raise errors[0]
+
+    def transcribe(self, frames, sample_rate=16000, on_partial=None):
+        ''' Transcribes frames, calling on_partial with each partial TranscriptEvent.
+        Returns TranscriptResult of the final transcripts. '''
+        finals = []
+        for event in self.stream(frames, sample_rate):
+            if event.is_partial:
+                if on_partial is not None:
+                    on_partial(event)
+            else:
+                finals.append(event.text)
+        return TranscriptResult(' '.join(finals))
+
+def wav_frames(path, frame_ms=100, realtime=False):
+    ''' Yields frames of a 16-bit mono wav file. With realtime=True frames come at
+    the speed they would from a microphone. '''
+    with wave.open(path, 'rb') as wav:
+        samples = int(wav.getframerate() * frame_ms / 1000)
+        while True:
+            frame = wav.readframes(samples)
+            if not frame:
+                return
+            yield frame
+            if realtime:
+                time.sleep(frame_ms / 1000.0)
+
+def microphone_frames(sample_rate=16000, frame_ms=100, seconds=5):
+    ''' Yields frames of 16-bit mono audio from the default microphone for
+    given number of seconds. Requires PyAudio (pip install pyaudio). '''
+    import pyaudio
+    samples = int(sample_rate * frame_ms / 1000)
+    audio = pyaudio.PyAudio()
+    stream = audio.open(format=pyaudio.paInt16, channels=1, rate=sample_rate,
+                        input=True, frames_per_buffer=samples)
+    try:
+        for i in range(int(seconds * 1000 / frame_ms)):
+            yield stream.read(samples, exception_on_overflow=False)
+    finally:
+        stream.stop_stream()
+        stream.close()
+        audio.terminate()
@@ -0,0 +1,54 @@
+import unittest
+from unittest import mock
+import batch
+
+class FakeClock(object):
+    ''' Stands in for the time module, sleeping only advances the clock. '''
+
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(batch, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fractional_rate(self):
+        bucket = batch.TokenBucket(0.5)
+        bucket.acquire()
+        self.assertEqual(self.clock.now, 0)
+        bucket.acquire()
+        self.assertAlmostEqual(self.clock.now, 2.0)
+
+    def test_burst(self):
+        bucket = batch.TokenBucket(2, capacity=4)
+        for i in range(4):
+            bucket.acquire()
+        self.assertEqual(self.clock.now, 0)
+        bucket.acquire()
+        self.assertAlmostEqual(self.clock.now, 0.5)
+
+class AnalysePictureTest(unittest.TestCase):
+
+    def test_failed_call_keeps_other_results(self):
+        picture = batch.Frame(b'picture')
+        with mock.patch.object(batch.rekognition, 'detect_faces', return_value=[]), \
+             mock.patch.object(batch.rekognition, 'compare_faces', side_effect=ValueError('no face')):
+            analysis = batch.analyse_picture(None, picture, True, False, picture, None)
+        self.assertEqual(analysis.faces, [])
+        self.assertEqual(list(analysis.errors), ['match'])
+        self.assertIn('errors', analysis.to_record('picture.jpg'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,64 +1,225 @@
-import boto3
-import requests
-from requests import get
-from pprint import pprint
 import json
+import threading
 import time
+from concurrent.futures import Future
+import awsclients
+from results import TranscriptResult, WordResult
 
-client=boto3.client('transcribe')
+def get_client():
+    ''' Returns Transcribe client shared through awsclients. '''
+    return awsclients.client('transcribe')
 
-def start_transcribe(job_name, file):
-    ''' Starts AWS Transcribe job with a given mp3 file in S3 bucket. '''
-    response = client.start_transcription_job(
+def start_transcribe(job_name, file, media_format='mp3'):
+    ''' Starts AWS Transcribe job with a given mp3 file in S3 bucket.
+    Wav files trimmed with vad.prepare_for_upload are started with media_format='wav'. '''
+    response = get_client().start_transcription_job(
         TranscriptionJobName=job_name,
         LanguageCode='en-US',
-        MediaFormat='mp3',
+        MediaFormat=media_format,
         Media={
             'MediaFileUri': file
             }
     )
 
-def get_job_status(job_name):
-    ''' Gets job status from AWS Transcribe.'''
-    response = client.get_transcription_job(
+def get_job(job_name):
+    ''' Gets job description from AWS Transcribe.'''
+    response = get_client().get_transcription_job(
     TranscriptionJobName=job_name
     )
-    return response['TranscriptionJob']['TranscriptionJobStatus']
+    return response['TranscriptionJob']
 
-def get_response(job_name, filetobedownloaded):
-    ''' Gets file url from a JSON file with job results from AWS Transcribe.
-    Downloads the file from Transcribe to local drive.'''
-    response = client.get_transcription_job(
-        TranscriptionJobName=job_name
-    )
-    dict = response['TranscriptionJob']
-    url= dict['Transcript']['TranscriptFileUri']
+def get_job_status(job_name):
+    ''' Gets job status from AWS Transcribe.'''
+    return get_job(job_name)['TranscriptionJobStatus']
+
+_http = None
+_http_lock = threading.Lock()
 
-    #Download file to local drive to be processed
-    def download(url, filetobedownloaded):
+def get_http_session():
+    ''' Returns requests session shared by transcript downloads, so connections are reused. '''
+    global _http
+    with _http_lock:
+        if _http is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            _http = requests.Session()
+            _http.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=10))
+        return _http
+
+def get_response(job, filetobedownloaded):
+    ''' Gets file url from job results from AWS Transcribe.
+    Downloads the file from Transcribe to local drive.
+    Job is the job description, e.g. from TranscribePoller, or the job name,
+    in which case the description is fetched from Transcribe.'''
+    if not isinstance(job, dict):
+        job = get_job(job)
+    url = job['Transcript']['TranscriptFileUri']
+
+    #Download file to local drive to be processed, in chunks over a shared connection
+    with get_http_session().get(url, stream=True, timeout=(5, 30)) as response:
+        response.raise_for_status()
         with open(filetobedownloaded, "wb") as file:
-            response = get(url)
-            file.write(response.content)
-    download(url,filetobedownloaded)
+            for chunk in response.iter_content(chunk_size=65536):
+                file.write(chunk)
+
+def parse_transcript(data):
+    ''' Returns TranscriptResult with words, timings and confidences from
+    transcript JSON of Transcribe. '''
+    words = []
+    for item in data['results'].get('items', []):
+        best = item['alternatives'][0]
+        words.append(WordResult(
+            best['content'],
+            float(item['start_time']) if 'start_time' in item else None,
+            float(item['end_time']) if 'end_time' in item else None,
+            float(best['confidence']) if best.get('confidence') not in (None, '') else None))
+    for item in data['results']['transcripts']:
+        return TranscriptResult(item['transcript'], data.get('jobName'), words)
+    return TranscriptResult('', data.get('jobName'), words)
+
+def fetch_transcript(job, archivefile=None):
+    ''' Downloads transcript of a completed job and parses it in memory.
+    Job is the job description or job name. If archivefile is given, the
+    transcript is also saved there in a background thread. Returns TranscriptResult. '''
+    if not isinstance(job, dict):
+        job = get_job(job)
+    response = get_http_session().get(job['Transcript']['TranscriptFileUri'], timeout=(5, 30))
+    response.raise_for_status()
+    body = response.content
+    if archivefile is not None:
+        archiver = threading.Thread(target=_archive, args=(archivefile, body))
+        archiver.start()
+    return parse_transcript(json.loads(body.decode('utf-8')))
+
+def _archive(archivefile, body):
+    with open(archivefile, 'wb') as file:
+        file.write(body)
 
 def get_brutus_response(brutusresponse):
-    ''' Processes def get_response given file, returns as text
-    what was said in audio file that Transcribe processed.   '''
+    ''' Processes def get_response given file, returns what was said in audio
+    file that Transcribe processed as TranscriptResult. Printed, it reads
+    'Command given: ' and the text. '''
     with open(brutusresponse, 'r') as readfile:
         data = json.load(readfile)
+    return parse_transcript(data)
 
-    for item in data['results']['transcripts']:
-        global brutus_input
-        brutus_input = item['transcript']
-        return 'Command given: ' + brutus_input
-
-def transcribe_brutus(job,jobname_stat,brutusresponse):
-    ''' Recursive function that prints out get_brutus_response
-    for a job started when the job is completed.
-    Used in conjuction with def start_transcribe.  '''
-    if str(get_job_status(jobname_stat))=='COMPLETED':
-        get_response(jobname_stat, brutusresponse)
-        print(str(get_brutus_response(brutusresponse)))
-    else:
-        time.sleep(5)
-        transcribe_brutus(jobname_stat)
+class TranscribePoller(object):
+    ''' Follows any number of Transcribe jobs from one background thread.
+    Each job is polled with its own delay, which grows by backoff after every
+    poll up to max_delay, and calls to Transcribe are spaced at least
+    min_interval seconds apart. Throttling from Transcribe doubles the delay. '''
+
+    def __init__(self, initial_delay=2, max_delay=30, backoff=1.5, min_interval=0.2):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.min_interval = min_interval
+        # job name -> [future, next poll time, delay, deadline]
+        self._jobs = {}
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def track(self, job_name, timeout=600):
+        ''' Starts following a job. Returns a Future that resolves to the job
+        description from Transcribe when the job is completed, or fails if the
+        job fails or is not completed in timeout seconds. A job already being
+        followed keeps its schedule and the same Future is returned. '''
+        now = time.time()
+        with self._condition:
+            if job_name in self._jobs:
+                return self._jobs[job_name][0]
+            future = Future()
+            future.set_running_or_notify_cancel()
+            self._jobs[job_name] = [future, now + self.initial_delay, self.initial_delay, now + timeout]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def pending(self):
+        with self._condition:
+            return len(self._jobs)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._jobs:
+                    self._thread = None
+                    return
+                job_name = min(self._jobs, key=lambda name: self._jobs[name][1])
+                wait = self._jobs[job_name][1] - time.time()
+                if wait > 0:
+                    # New jobs wake the thread up to reconsider
+                    self._condition.wait(wait)
+                    continue
+                future, _, delay, deadline = self._jobs[job_name]
+            self._poll(job_name, future, delay, deadline)
+            time.sleep(self.min_interval)
+
+    def _poll(self, job_name, future, delay, deadline):
+        import botocore.exceptions
+        try:
+            job = get_client().get_transcription_job(TranscriptionJobName=job_name)['TranscriptionJob']
+        except botocore.exceptions.ClientError as error:
+            if error.response['Error']['Code'] in ('ThrottlingException', 'LimitExceededException'):
+                self._reschedule(job_name, deadline, min(delay * 2, self.max_delay))
+            else:
+                self._finish(job_name, future, error=error)
+            return
+        except Exception as error:
+            self._finish(job_name, future, error=error)
+            return
+        status = job['TranscriptionJobStatus']
+        if status == 'COMPLETED':
+            self._finish(job_name, future, job=job)
+        elif status == 'FAILED':
+            self._finish(job_name, future, error=RuntimeError(
+                'Transcription job %s failed: %s' % (job_name, job.get('FailureReason'))))
+        else:
+            self._reschedule(job_name, deadline, min(delay * self.backoff, self.max_delay))
+
+    def _reschedule(self, job_name, deadline, delay):
+        now = time.time()
+        with self._condition:
+            entry = self._jobs.get(job_name)
+            if entry is None:
+                return
+            if now < deadline:
+                # Last poll is made at the deadline
+                entry[1] = min(now + delay, deadline)
+                entry[2] = delay
+                return
+            del self._jobs[job_name]
+        entry[0].set_exception(TimeoutError('Transcription job %s did not complete in time' % job_name))
+
+    def _finish(self, job_name, future, job=None, error=None):
+        with self._condition:
+            if job_name in self._jobs and self._jobs[job_name][0] is future:
+                del self._jobs[job_name]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(job)
+
+_poller = None
+_poller_lock = threading.Lock()
+
+def get_poller():
+    ''' Returns the shared TranscribePoller. '''
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            _poller = TranscribePoller()
+        return _poller
+
+def transcribe_brutus(job,jobname_stat,brutusresponse=None,timeout=600):
+    ''' Waits until a job started with def start_transcribe is completed, prints
+    out and returns its transcript. Waiting is done by the shared TranscribePoller,
+    so many jobs can be followed at the same time. Transcript is parsed in memory,
+    and saved to brutusresponse in background if it is given. '''
+    job = get_poller().track(jobname_stat, timeout).result()
+    transcript = fetch_transcript(job, brutusresponse)
+    print(str(transcript))
+    return transcript
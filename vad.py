@@ -0,0 +1,137 @@
+''' Energy based voice activity detection for 16-bit mono PCM audio.
+Silence is trimmed and recordings are split into utterances locally, so less
+audio is uploaded to S3 and processed by Transcribe. '''
+import wave
+# numpy is imported in the functions using it
+
+class VADReport(object):
+    ''' Speech segments found in audio, as (start, end) sample indexes, and
+    how many seconds of audio were removed. speech_found is False when no speech
+    was detected and the whole recording was kept untrimmed. '''
+    __slots__ = ('segments', 'sample_rate', 'original_seconds', 'kept_seconds', 'speech_found')
+
+    def __init__(self, segments, sample_rate, total_samples, speech_found=True):
+        self.segments = segments
+        self.sample_rate = sample_rate
+        self.speech_found = speech_found
+        self.original_seconds = total_samples / float(sample_rate)
+        self.kept_seconds = sum(end - start for start, end in segments) / float(sample_rate)
+
+    @property
+    def removed_seconds(self):
+        return self.original_seconds - self.kept_seconds
+
+    def __repr__(self):
+        return 'VADReport(%d segments, %.2f s of %.2f s removed%s)' % (
+            len(self.segments), self.removed_seconds, self.original_seconds,
+            '' if self.speech_found else ', no speech found')
+
+def frame_energies(samples, frame_length):
+    ''' Returns energy of each frame of samples in dB relative to full scale. '''
+    import numpy as np
+    count = len(samples) // frame_length
+    frames = np.asarray(samples[:count * frame_length], dtype=np.float64).reshape(count, frame_length)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1)) / 32768.0
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+def speech_segments(samples, sample_rate, frame_ms=30, threshold_db=None, margin_db=15,
+                    peak_margin_db=10, min_silence_ms=300, min_speech_ms=100, padding_ms=150):
+    ''' Finds speech in samples and returns VADReport. Frames louder than
+    threshold_db are speech; without threshold_db it is margin_db above the noise
+    floor of the recording, but at most peak_margin_db below its loud end, so
+    recordings without silence are kept. Pauses shorter than min_silence_ms are
+    kept inside a segment, segments shorter than min_speech_ms are dropped and
+    padding_ms of audio is kept around each segment. If no speech is found, the
+    whole recording is returned as one segment with speech_found False. '''
+    import numpy as np
+    frame_length = max(1, int(sample_rate * frame_ms / 1000))
+    energies = frame_energies(samples, frame_length)
+    if len(energies) == 0:
+        return VADReport([], sample_rate, len(samples))
+    if threshold_db is None:
+        # Quietest frames tell the noise floor, loudest frames the level of speech
+        threshold_db = min(np.percentile(energies, 10) + margin_db,
+                           np.percentile(energies, 95) - peak_margin_db)
+        threshold_db = max(threshold_db, -60)
+    speech = np.concatenate(([False], energies > threshold_db, [False]))
+    changes = np.flatnonzero(speech[1:] != speech[:-1])
+    starts, ends = changes[0::2], changes[1::2]
+
+    min_silence = min_silence_ms / float(frame_ms)
+    min_speech = min_speech_ms / float(frame_ms)
+    padding = int(sample_rate * padding_ms / 1000)
+    merged = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if merged and start - merged[-1][1] < min_silence:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    segments = []
+    for start, end in merged:
+        if end - start < min_speech:
+            continue
+        start = max(0, start * frame_length - padding)
+        end = min(len(samples), end * frame_length + padding)
+        if segments and start <= segments[-1][1]:
+            segments[-1] = (segments[-1][0], end)
+        else:
+            segments.append((start, end))
+    if not segments:
+        # Better to upload silence than to lose a command
+        return VADReport([(0, len(samples))], sample_rate, len(samples), speech_found=False)
+    return VADReport(segments, sample_rate, len(samples))
+
+def trim_silence(samples, sample_rate, **options):
+    ''' Returns samples from the start of the first to the end of the last
+    speech segment, and VADReport of what was kept. '''
+    report = speech_segments(samples, sample_rate, **options)
+    if not report.segments:
+        return samples[:0], report
+    start, end = report.segments[0][0], report.segments[-1][1]
+    return samples[start:end], VADReport([(start, end)], sample_rate, len(samples), report.speech_found)
+
+def split_utterances(samples, sample_rate, **options):
+    ''' Returns list of samples of each speech segment, and VADReport. '''
+    report = speech_segments(samples, sample_rate, **options)
+    return [samples[start:end] for start, end in report.segments], report
+
+def read_wav(path):
+    ''' Reads 16-bit mono wav file, returns samples as numpy array and sample rate. '''
+    import numpy as np
+    with wave.open(path, 'rb') as wav:
+        if wav.getsampwidth() != 2 or wav.getnchannels() != 1:
+            raise ValueError('%s is not 16-bit mono audio' % path)
+        return np.frombuffer(wav.readframes(wav.getnframes()), dtype='<i2'), wav.getframerate()
+
+def write_wav(path, samples, sample_rate):
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(samples.astype('<i2').tobytes())
+
+def prepare_for_upload(inputfile, outputprefix=None, split=True, **options):
+    ''' Trims silence from a wav recording, and splits it into utterances if split
+    is True. Writes outputprefix1.wav, outputprefix2.wav and so on. Prints and
+    returns the written files and VADReport. If no speech is found, the untrimmed
+    recording is written as outputprefix1.wav and report.speech_found is False.
+    Raises ValueError if the recording is empty. '''
+    samples, sample_rate = read_wav(inputfile)
+    if len(samples) == 0:
+        raise ValueError('%s contains no audio' % inputfile)
+    if outputprefix is None:
+        outputprefix = inputfile.rsplit('.', 1)[0] + '_speech'
+    if split:
+        parts, report = split_utterances(samples, sample_rate, **options)
+    else:
+        trimmed, report = trim_silence(samples, sample_rate, **options)
+        parts = [trimmed] if len(trimmed) else []
+    outputfiles = []
+    for n, part in enumerate(parts):
+        outputfiles.append('%s%d.wav' % (outputprefix, n + 1))
+        write_wav(outputfiles[-1], part, sample_rate)
+    if not report.speech_found:
+        print('No speech found in %s, keeping untrimmed audio' % inputfile)
+    print('Removed %.2f s of %.2f s audio, %d utterances' % (
+        report.removed_seconds, report.original_seconds, len(outputfiles)))
+    return outputfiles, report